@@ -1,13 +1,22 @@
 #!/usr/bin/env python3
 
 import os
+import re
 import json
 import time
+import asyncio
+import hashlib
 import logging
 import threading
-from typing import List, Dict, Any
+import http.client
+import urllib.parse
+import urllib.request
+from xml.etree import ElementTree
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
 import anthropic
-import arxiv
+import orjson
 
 
 logging.basicConfig(
@@ -20,60 +29,120 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-def search_arxiv_papers(year: int, max_results: int = 200) -> List[Dict[str, Any]]:
-    """Search arxiv papers by year and category using arxiv.query."""
+AGENT_KEYWORDS = ("agent", "multi-agent", "agentic", "planning", "reasoning", "tool calling", "tool use")
 
-    logger.info(f"Starting search for year {year} with max_results={max_results}")
+# 全キーワードを1つのパターンにまとめ、1回の走査でマッチ判定する（大文字小文字は無視）
+_AGENT_PATTERN = re.compile("|".join(map(re.escape, AGENT_KEYWORDS)), re.IGNORECASE)
+
+CACHE_DIR = ".cache"
+
+# 最終出力の棒グラフ行（例: "2020年 : ███ 15論文 (7.50%)"）。区切り文字の書き方は問わない
+_FINAL_REPORT_LINE = re.compile(r"\d{4}年[^\n]*?論文")
+
+ARXIV_API_URL = "https://export.arxiv.org/api/query"
+ARXIV_PAGE_SIZE = 1000
+# arxivは空・途中までのフィードを返すことがあるため、空ページは再取得する
+ARXIV_NUM_RETRIES = 3
+
+_ATOM_NS = "{http://www.w3.org/2005/Atom}"
+_ATOM_ENTRY = f"{_ATOM_NS}entry"
+_ATOM_TITLE = f"{_ATOM_NS}title"
+_ATOM_SUMMARY = f"{_ATOM_NS}summary"
+
+# 範囲ツール1回で検索できる最大年数（1年ごとにレート制限付きのリクエストが発生する）
+MAX_RANGE_YEARS = 10
+# 範囲ツールで1年あたりに取得できる最大件数（超えるとページ分のリクエストが増える）
+MAX_PER_YEAR_RESULTS = 1000
+
+# 会話履歴に残すツール結果・出力の最大文字数
+HISTORY_TEXT_MAX_CHARS = 2000
+
+# arxivへのリクエスト開始間隔（秒）。arxiv APIの利用規約（3秒に1リクエスト）に合わせ、
+# 並行実行時も全スレッドで共有する
+ARXIV_REQUEST_INTERVAL = 3.0
+_rate_limit_lock = threading.Lock()
+_next_request_time = 0.0
+
+def _wait_for_rate_limit() -> None:
+    """Reserve the next arxiv request slot and sleep only until it opens."""
+
+    global _next_request_time
+    with _rate_limit_lock:
+        now = time.monotonic()
+        wait = max(0.0, _next_request_time - now)
+        _next_request_time = max(now, _next_request_time) + ARXIV_REQUEST_INTERVAL
+    if wait > 0:
+        time.sleep(wait)
+
+def _iter_arxiv_page(query: str, start: int, page_size: int) -> Iterator[Tuple[str, str]]:
+    """Fetch one page of the arxiv Atom feed and stream (title, abstract) pairs from it."""
+
+    params = urllib.parse.urlencode({
+        "search_query": query,
+        "start": start,
+        "max_results": page_size,
+        "sortBy": "submittedDate",
+        "sortOrder": "descending"
+    })
+
+    _wait_for_rate_limit()
+
+    with urllib.request.urlopen(f"{ARXIV_API_URL}?{params}", timeout=60) as response:
+        # フィード全体を木として構築せず、entry単位で読み取って破棄する
+        for _, elem in ElementTree.iterparse(response):
+            if elem.tag == _ATOM_ENTRY:
+                # フィードは長いタイトルを改行で折り返すため、空白を1つにまとめる
+                title = " ".join(elem.findtext(_ATOM_TITLE, "").split())
+                yield title, elem.findtext(_ATOM_SUMMARY, "")
+                elem.clear()
+
+def search_arxiv_papers(year: int, max_results: int = 200) -> Iterator[Tuple[str, str]]:
+    """Stream (title, abstract) pairs of cs.AI papers submitted in the given year."""
 
     start_date = f"{year}0101"
     end_date = f"{year}1231"
 
     query = f'cat:cs.AI AND submittedDate:[{start_date} TO {end_date}]'
     logger.info(f"Arxiv query: {query}")
+    logger.info(f"Requesting arxiv API with max_results={max_results}...")
+
+    # 結果をリストに溜めず、max_results件に達するかページが尽きるまで取得する
+    fetched = 0
+    while fetched < max_results:
+        page_size = min(ARXIV_PAGE_SIZE, max_results - fetched)
+        page_count = 0
+        for attempt in range(ARXIV_NUM_RETRIES + 1):
+            try:
+                for title, abstract in _iter_arxiv_page(query, fetched, page_size):
+                    page_count += 1
+                    yield title, abstract
+            except (OSError, http.client.HTTPException, ElementTree.ParseError) as e:
+                # 一部を返した後は重複して数えないよう再取得しない
+                if page_count or attempt == ARXIV_NUM_RETRIES:
+                    raise
+                logger.warning(f"Arxiv page at start={fetched} failed ({e}), retrying ({attempt + 1}/{ARXIV_NUM_RETRIES})")
+                continue
+            if page_count or attempt == ARXIV_NUM_RETRIES:
+                break
+            logger.warning(f"Arxiv returned an empty page at start={fetched}, retrying ({attempt + 1}/{ARXIV_NUM_RETRIES})")
 
-    try:
-        logger.info(f"Executing arxiv.Client with max_results={max_results}...")
-        client = arxiv.Client()
-        search = arxiv.Search(
-            query=query,
-            max_results=max_results,
-            sort_by=arxiv.SortCriterion.SubmittedDate
-        )
-
-        results = list(client.results(search))[:max_results]
-        logger.info(f"Found {len(results)} papers for year {year}")
-
-        papers = []
-        for i, result in enumerate(results):
-            papers.append({
-                "title": result.title,
-                "abstract": result.summary,
-                "published": result.published.strftime("%Y-%m-%d"),
-                "categories": result.categories
-            })
-
-        logger.info(f"Successfully processed {len(papers)} papers")
-        time.sleep(1)
-        return papers
-
-    except Exception as e:
-        logger.error(f"Error searching arxiv for year {year}: {str(e)}", exc_info=True)
-        return []
+        if page_count == 0 and fetched == 0:
+            raise RuntimeError(f"Arxiv returned no results for year {year} after {ARXIV_NUM_RETRIES} retries")
+        fetched += page_count
+        if page_count < page_size:
+            break
 
-def filter_agent_papers(papers: List[Dict[str, Any]], year: int) -> Dict[str, int]:
+def filter_agent_papers(papers: Iterable[Tuple[str, str]], year: int) -> Dict[str, int]:
     """Filter and count Agent-focused papers vs Other AI based on keywords."""
 
-    agent_keywords = ["agent", "multi-agent", "agentic", "planning", "reasoning", "tool calling", "tool use"]
-
     agent_count = 0
-    total_count = len(papers)
+    total_count = 0
 
-    for paper in papers:
-        title = paper.get("title", "").lower()
-        abstract = paper.get("abstract", "").lower()
-        text = title + " " + abstract
+    for title, abstract in papers:
+        total_count += 1
 
-        if any(keyword in text for keyword in agent_keywords):
+        # タイトルとアブストラクトを連結せず個別に検索し、タイトルで一致すれば打ち切る
+        if _AGENT_PATTERN.search(title) or _AGENT_PATTERN.search(abstract):
             agent_count += 1
 
     return {
@@ -82,6 +151,81 @@ def filter_agent_papers(papers: List[Dict[str, Any]], year: int) -> Dict[str, in
         "agent_papers": agent_count
     }
 
+# 件数が揃った検索結果 (title, abstract) だけを保持するプロセス内キャッシュ
+_paper_cache: Dict[Tuple[int, int], List[Tuple[str, str]]] = {}
+
+def _cached_arxiv_papers(year: int, max_results: int) -> Iterator[Tuple[str, str]]:
+    """Stream papers for a closed year from the cache, searching arxiv and caching them on a miss."""
+
+    key = (year, max_results)
+    cache_path = os.path.join(CACHE_DIR, f"arxiv_papers_{year}_{max_results}.json")
+    if key not in _paper_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                _paper_cache[key] = [(title, abstract) for title, abstract in json.load(f)]
+            logger.info(f"Loaded {len(_paper_cache[key])} cached papers for {year} from {cache_path}")
+        except ValueError as e:
+            # 壊れたキャッシュは削除してarxivから取り直す
+            logger.warning(f"Discarding unreadable cache {cache_path}: {e}")
+            os.remove(cache_path)
+
+    if key in _paper_cache:
+        yield from _paper_cache[key]
+        return
+
+    # フィルタへ流しながら同じパスで保存用に溜める
+    papers = []
+    for paper in search_arxiv_papers(year, max_results):
+        papers.append(paper)
+        yield paper
+
+    # 途中で途切れたフィードの結果を確定値として残さない
+    if len(papers) < max_results:
+        logger.warning(f"Only {len(papers)}/{max_results} papers for {year}; not caching")
+        return
+
+    _paper_cache[key] = papers
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # 一時ファイルに書き切ってから置き換え、途中までのJSONを残さない
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(papers, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+    logger.info(f"Cached {len(papers)} papers for {year} to {cache_path}")
+
+def search_and_filter_year(year: int, max_results: int = 200) -> Dict[str, int]:
+    """Search arxiv papers for a single year and return the Agent count summary."""
+
+    logger.info(f"Starting search for year {year} with max_results={max_results}")
+
+    try:
+        # 今年の論文はまだ増えるためキャッシュしない
+        if year >= datetime.now().year:
+            papers = search_arxiv_papers(year, max_results)
+        else:
+            papers = _cached_arxiv_papers(year, max_results)
+
+        filter_results = filter_agent_papers(papers, year)
+        logger.info(f"Retrieved {filter_results['total_papers']} papers for {year}")
+        return filter_results
+
+    except Exception as e:
+        logger.error(f"Error searching arxiv for year {year}: {str(e)}", exc_info=True)
+        return {"year": year, "total_papers": 0, "agent_papers": 0}
+
+async def _gather_years(years: List[int], max_results: int) -> List[Dict[str, int]]:
+    """Run the per-year searches concurrently on worker threads."""
+
+    return await asyncio.gather(
+        *(asyncio.to_thread(search_and_filter_year, year, max_results) for year in years)
+    )
+
+def search_and_filter_years(years: List[int], max_results: int = 200) -> List[Dict[str, int]]:
+    """Search and filter several years concurrently, preserving the order of years."""
+
+    logger.info(f"Starting concurrent search for years {years}")
+    return asyncio.run(_gather_years(years, max_results))
+
 
 def process_tool_call(tool_name: str, tool_input: Dict[str, Any]) -> str:
     """Process tool calls from Claude."""
@@ -94,69 +238,238 @@ def process_tool_call(tool_name: str, tool_input: Dict[str, Any]) -> str:
 
         logger.info(f"Tool parameters: year={year}, max_results={max_results}")
 
-        # Search papers
-        papers = search_arxiv_papers(year, max_results)
-        logger.info(f"Retrieved {len(papers)} papers for {year}")
+        # Search papers, filter and return count summary
+        filter_results = search_and_filter_year(year, max_results)
 
-        # Filter papers and return count summary
-        filter_results = filter_agent_papers(papers, year)
-
-        result = json.dumps(filter_results, ensure_ascii=False)
+        result = orjson.dumps(filter_results).decode()
         other_count = filter_results['total_papers'] - filter_results['agent_papers']
         logger.info(f"Filter result: {filter_results['agent_papers']} Agent, {other_count} Other out of {filter_results['total_papers']} total")
         return result
 
+    if tool_name == "search_and_filter_papers_range":
+        start_year = tool_input.get("start_year")
+        end_year = tool_input.get("end_year")
+        per_year_max = tool_input.get("per_year_max", 200)
+
+        logger.info(f"Tool parameters: start_year={start_year}, end_year={end_year}, per_year_max={per_year_max}")
+
+        if not all(isinstance(v, int) and not isinstance(v, bool) for v in (start_year, end_year, per_year_max)):
+            logger.warning(f"Invalid range tool input: {tool_input}")
+            return "Invalid input: start_year, end_year and per_year_max must be integers"
+        if (start_year > end_year or end_year - start_year + 1 > MAX_RANGE_YEARS
+                or not 1 <= per_year_max <= MAX_PER_YEAR_RESULTS):
+            logger.warning(f"Invalid range tool input: {tool_input}")
+            return (f"Invalid input: start_year must be <= end_year, spanning at most {MAX_RANGE_YEARS} years, "
+                    f"and per_year_max must be between 1 and {MAX_PER_YEAR_RESULTS}")
+
+        # 1回のツール呼び出しで全年分を集計し、年ごとの往復ターンを省く
+        years = list(range(start_year, end_year + 1))
+        filter_results = {
+            str(summary["year"]): summary
+            for summary in search_and_filter_years(years, per_year_max)
+        }
+
+        result = orjson.dumps(filter_results).decode()
+        logger.info(f"Range filter result for {len(filter_results)} years")
+        return result
+
     logger.warning(f"Unknown tool: {tool_name}")
     return f"Unknown tool: {tool_name}"
 
-def run_analysis() -> str:
-    """Main analysis function using advanced PTC with Claude. Returns markdown report."""
+def _is_final_report(text: str) -> bool:
+    """Return whether a text block holds the final ASCII bar chart."""
 
-    logger.info("Starting arxiv trend analysis")
+    # コードブロックを含まない途中の推論テキストは正規表現を走らせずに除外する
+    return "```" in text and _FINAL_REPORT_LINE.search(text) is not None
 
-    api_key = os.getenv("ANTHROPIC_API_KEY")
-    if not api_key:
-        logger.error("ANTHROPIC_API_KEY environment variable not set")
-        raise ValueError("ANTHROPIC_API_KEY environment variable not set")
+def _truncate_text(text: str, limit: int = HISTORY_TEXT_MAX_CHARS) -> str:
+    """Cut text to limit characters, noting how much was dropped."""
 
-    logger.info("Using direct Anthropic API")
-    client = anthropic.Anthropic(api_key=api_key)
+    if len(text) <= limit:
+        return text
+    return text[:limit] + f"\n[truncated {len(text) - limit} chars]"
+
+def _trim_tool_result(content: str, limit: int = HISTORY_TEXT_MAX_CHARS) -> str:
+    """Shrink a tool_result payload carried into later turns, keeping JSON payloads valid JSON."""
 
-    tools = [
-        {
-            "type": "code_execution_20250825",
-            "name": "code_execution"
-        },
-        {
-            "name": "search_and_filter_papers",
-            "description": "Search arxiv papers and filter for Agent-related papers (returns only count summary)",
-            "input_schema": {
-                "type": "object",
-                "properties": {
-                    "year": {
-                        "type": "integer",
-                        "description": "Year to search (2020-2025)"
-                    },
-                    "max_results": {
-                        "type": "integer",
-                        "description": "Maximum papers to return",
-                        "default": 200
-                    }
+    if len(content) <= limit:
+        return content
+    try:
+        data = orjson.loads(content)
+    except orjson.JSONDecodeError:
+        return _truncate_text(content, limit)
+
+    # 文字列の途中で切らず、要素単位で落として有効なJSONのまま上限に収める
+    if isinstance(data, dict):
+        entries = list(data.items())
+        while entries and len(orjson.dumps(dict(entries))) > limit:
+            entries.pop()
+        trimmed: Any = dict(entries)
+        trimmed["_truncated_entries"] = len(data) - len(entries)
+    elif isinstance(data, list):
+        entries = list(data)
+        while entries and len(orjson.dumps(entries)) > limit:
+            entries.pop()
+        trimmed = entries + [{"_truncated_items": len(data) - len(entries)}]
+    else:
+        trimmed = _truncate_text(str(data), limit)
+    return orjson.dumps(trimmed).decode()
+
+def _minimize_blocks(content: List[Any]) -> List[Any]:
+    """Compact assistant content blocks before they are carried into the next request."""
+
+    minimized = []
+    for block in content:
+        if block.type == "server_tool_use" and "file_text" in block.input:
+            # 生成済みコード本体は次のターンに不要なので、ハッシュ参照に置き換える
+            data = block.model_dump(exclude_none=True)
+            file_text = data["input"]["file_text"]
+            digest = hashlib.sha256(file_text.encode("utf-8")).hexdigest()[:12]
+            data["input"] = {**data["input"], "file_text": f"[omitted {len(file_text)} chars, sha256:{digest}]"}
+            minimized.append(data)
+        elif "tool_result" in block.type:
+            data = block.model_dump(exclude_none=True)
+            result = data.get("content")
+            if isinstance(result, dict):
+                data["content"] = {
+                    key: _truncate_text(value) if isinstance(value, str) else value
+                    for key, value in result.items()
+                }
+            minimized.append(data)
+        else:
+            minimized.append(block)
+    return minimized
+
+# 既知のブロック型はスキーマが固定なので、hasattr/dirを使わずこれらのフィールドを直接参照する
+_BLOCK_LOG_FIELDS = {
+    "tool_use": ("name", "input", "id"),
+    "server_tool_use": ("name", "id", "input"),
+}
+
+def _log_block_fields(block: Any, fields: Tuple[str, ...]) -> None:
+    for field in fields:
+        logger.debug("  %s: %s", field, getattr(block, field))
+
+def _log_text_block(block: Any) -> None:
+    logger.debug("Text: %s%s", block.text[:200], '...' if len(block.text) > 200 else '')
+
+def _log_tool_use_block(block: Any) -> None:
+    _log_block_fields(block, _BLOCK_LOG_FIELDS["tool_use"])
+
+def _log_server_tool_use_block(block: Any) -> None:
+    _log_block_fields(block, _BLOCK_LOG_FIELDS["server_tool_use"])
+    # Log Python code if it's code execution
+    if block.name in ['text_editor_code_execution', 'bash_code_execution']:
+        if 'file_text' in block.input:
+            logger.debug("Generated Python Code:")
+            logger.debug("%s", block.input['file_text'])
+        elif 'command' in block.input:
+            logger.debug("Bash Command: %s", block.input['command'])
+
+def _log_tool_result_block(block: Any) -> None:
+    content = str(block.content)
+    logger.debug("  tool_use_id: %s", block.tool_use_id)
+    logger.debug("  content: %s%s", content[:500], '...' if len(content) > 500 else '')
+    # Log stdout if available (for bash execution results)
+    stdout = getattr(block.content, 'stdout', None)
+    if stdout is not None:
+        logger.debug("Stdout: %s", stdout)
+
+# 未知のブロック型ごとに公開属性名を一度だけ調べて再利用する
+_unknown_block_attrs: Dict[type, List[str]] = {}
+
+def _log_unknown_block(block: Any) -> None:
+    logger.debug("Unknown block type: %s", block.type)
+    # Log all available attributes for unknown types
+    logger.debug("All attributes:")
+    attrs = _unknown_block_attrs.get(type(block))
+    if attrs is None:
+        attrs = [attr for attr in dir(block) if not attr.startswith('_')]
+        _unknown_block_attrs[type(block)] = attrs
+    for attr in attrs:
+        try:
+            value = getattr(block, attr)
+            if not callable(value):
+                logger.debug("  %s: %s", attr, value)
+        except Exception:
+            pass
+
+_BLOCK_LOGGERS = {
+    "text": _log_text_block,
+    "tool_use": _log_tool_use_block,
+    "server_tool_use": _log_server_tool_use_block,
+}
+
+def _log_block(index: int, block: Any) -> None:
+    """Log the details of one response content block at DEBUG level."""
+
+    logger.debug("Block %d (%s):", index, block.type)
+    log_block = _BLOCK_LOGGERS.get(block.type)
+    if log_block is None:
+        # *_tool_result系の型は初回に判定し、以降は辞書引きだけで済ませる
+        log_block = _log_tool_result_block if 'tool_result' in block.type else _log_unknown_block
+        _BLOCK_LOGGERS[block.type] = log_block
+    log_block(block)
+    logger.debug("---")
+
+TOOLS = [
+    {
+        "type": "code_execution_20250825",
+        "name": "code_execution"
+    },
+    {
+        "name": "search_and_filter_papers",
+        "description": "Search arxiv papers and filter for Agent-related papers (returns only count summary)",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "year": {
+                    "type": "integer",
+                    "description": "Year to search (2020-2025)"
                 },
-                "required": ["year"]
-            }
+                "max_results": {
+                    "type": "integer",
+                    "description": "Maximum papers to return",
+                    "default": 200
+                }
+            },
+            "required": ["year"]
         }
-    ]
+    },
+    {
+        "name": "search_and_filter_papers_range",
+        "description": "Search arxiv papers for every year in a range and filter for Agent-related papers (returns one count summary per year, keyed by year)",
+        "input_schema": {
+            "type": "object",
+            "properties": {
+                "start_year": {
+                    "type": "integer",
+                    "description": "First year to search (2020-2025)"
+                },
+                "end_year": {
+                    "type": "integer",
+                    "description": "Last year to search, inclusive (2020-2025)"
+                },
+                "per_year_max": {
+                    "type": "integer",
+                    "description": f"Maximum papers to return per year (at most {MAX_PER_YEAR_RESULTS})",
+                    "default": 200
+                }
+            },
+            "required": ["start_year", "end_year"]
+        }
+    }
+]
 
-    initial_prompt = """タスク: cs.AI論文のAgent研究増加傾向分析（2020-2025）
+INITIAL_PROMPT = """タスク: cs.AI論文のAgent研究増加傾向分析（2020-2025）
 
 目的: cs.AIカテゴリの論文(2020-2025年、各年200件)のタイトル・アブストラクトを分析し、Agent研究の増加傾向を示す
 
 実行手順:
-1. 2020年から2025年まで各年でsearch_and_filter_papersツールを呼び出し:
+1. search_and_filter_papers_rangeツールをstart_year=2020, end_year=2025で1回だけ呼び出し:
    - 各年のcs.AI論文を200件検索
    - Agent関連キーワードでフィルタリング実行
-   - 集計結果を受け取り: {"year": 2020, "total_papers": 200, "agent_papers": 10}
+   - 年ごとの集計結果を受け取り: {"2020": {"year": 2020, "total_papers": 200, "agent_papers": 10}, ...}
 
 2. code_executionで受け取った各年の結果からASCII棒グラフ生成:
    - numpy.histogramを使用してヒストグラムデータを作成
@@ -174,7 +487,7 @@ def run_analysis() -> str:
 ```
 
 重要:
-- search_and_filter_papersツールを2020年から2025年で各1回ずつ（計6回）呼び出し
+- search_and_filter_papers_rangeツールを1回だけ呼び出す（年ごとに個別に呼び出さない）
 - code_executionでnumpyを活用:
   * import numpy as np
   * 各年のAgent論文数データを配列として作成
@@ -184,29 +497,49 @@ def run_analysis() -> str:
 - 上記の形式のみを出力（他の説明や分析は不要）
 - ASCII棒グラフは```コードブロックで囲む"""
 
-    messages = [{"role": "user", "content": initial_prompt}]
+def run_analysis() -> str:
+    """Main analysis function using advanced PTC with Claude. Returns markdown report."""
+
+    logger.info("Starting arxiv trend analysis")
+
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        logger.error("ANTHROPIC_API_KEY environment variable not set")
+        raise ValueError("ANTHROPIC_API_KEY environment variable not set")
+
+    logger.info("Using direct Anthropic API")
+    client = anthropic.Anthropic(api_key=api_key)
+
+    messages = [{"role": "user", "content": INITIAL_PROMPT}]
 
     logger.info("Starting conversation with Claude")
     logger.info("=== INITIAL PROMPT ===")
-    logger.info(initial_prompt)
+    logger.info(INITIAL_PROMPT)
     logger.info("========================")
     turn_count = 0
     markdown_result = ""
 
+    # 会話全体を毎ターン文字列化せず、追加分だけ加算して入力サイズを見積もる
+    log_input_size = logger.isEnabledFor(logging.INFO)
+    conversation_chars = len(INITIAL_PROMPT) if log_input_size else 0
+
+    # 直前のターンで送ったツール結果（次のターン以降の履歴で縮める対象）
+    previous_tool_results: List[Dict[str, Any]] = []
+
     while True:
         turn_count += 1
         logger.info(f"Turn {turn_count}: Sending request to Claude")
 
         # Log input message size and details
-        total_chars = sum(len(str(msg)) for msg in messages)
-        logger.info(f"=== INPUT SIZE (Turn {turn_count}) ===")
-        logger.info(f"Messages count: {len(messages)}")
-        logger.info(f"Total characters: {total_chars}")
-        logger.info(f"Estimated input tokens: ~{total_chars // 4}")
+        if log_input_size:
+            logger.info(f"=== INPUT SIZE (Turn {turn_count}) ===")
+            logger.info(f"Messages count: {len(messages)}")
+            logger.info(f"Total characters: {conversation_chars}")
+            logger.info(f"Estimated input tokens: ~{conversation_chars // 4}")
 
-        # Show recent message roles for debugging
-        logger.info(f"Message roles: {[msg['role'] for msg in messages[-5:]]}")  # Last 5 messages
-        logger.info(f"=====================================")
+            # Show recent message roles for debugging
+            logger.info(f"Message roles: {[msg['role'] for msg in messages[-5:]]}")  # Last 5 messages
+            logger.info(f"=====================================")
 
         try:
             # Use non-streaming for proper PTC behavior
@@ -214,30 +547,34 @@ def run_analysis() -> str:
             start_time = time.time()
 
             # Progress indicator for long requests
+            stop_progress = threading.Event()
+
             def progress_indicator():
                 dots = 0
-                while not hasattr(progress_indicator, 'stop'):
+                while not stop_progress.wait(1.0):
                     elapsed = time.time() - start_time
                     print(f"\r[{elapsed:.1f}s] Processing PTC{'.' * (dots % 4)}", end='', flush=True)
                     dots += 1
-                    time.sleep(1)
 
             progress_thread = threading.Thread(target=progress_indicator)
             progress_thread.daemon = True
             progress_thread.start()
 
-            # Use non-streaming API with extended timeout for PTC
-            response = client.beta.messages.create(
-                betas=["advanced-tool-use-2025-11-20"],
-                model="claude-sonnet-4-5-20250929",
-                max_tokens=10000,
-                tools=tools,
-                messages=messages,
-                timeout=300  # 5 minutes timeout
-            )
-
-            # Stop progress indicator
-            progress_indicator.stop = True
+            try:
+                # Use non-streaming API with extended timeout for PTC
+                response = client.beta.messages.create(
+                    betas=["advanced-tool-use-2025-11-20"],
+                    model="claude-sonnet-4-5-20250929",
+                    max_tokens=10000,
+                    tools=TOOLS,
+                    messages=messages,
+                    timeout=300  # 5 minutes timeout
+                )
+            finally:
+                # Stop progress indicator
+                stop_progress.set()
+                progress_thread.join(timeout=2)
+
             elapsed_total = time.time() - start_time
             logger.info(f"PTC request completed in {elapsed_total:.2f} seconds")
 
@@ -270,60 +607,17 @@ def run_analysis() -> str:
             logger.info(f"Content blocks: {len(response.content)}")
             logger.info(f"========================")
 
-            logger.info(f"=== CLAUDE RESPONSE (Turn {turn_count}) ===")
-            for i, block in enumerate(response.content):
-                logger.info(f"Block {i} ({block.type}):")
-                if block.type == "text":
-                    logger.info(f"Text: {block.text[:200]}{'...' if len(block.text) > 200 else ''}")
-                    # Collect only the final markdown result with ASCII bar chart
-                    if "```" in block.text and ("年" in block.text and "論文" in block.text):
-                        markdown_result = block.text  # Only keep the final result
-                elif block.type == "tool_use":
-                    logger.info(f"Tool: {block.name}")
-                    logger.info(f"Input: {block.input}")
-                    logger.info(f"ID: {block.id}")
-                elif block.type == "server_tool_use":
-                    logger.info(f"Server Tool: {block.name}")
-                    logger.info(f"ID: {block.id}")
-                    if hasattr(block, 'input'):
-                        logger.info(f"Input: {block.input}")
-                        # Log Python code if it's code execution
-                        if block.name in ['text_editor_code_execution', 'bash_code_execution']:
-                            if 'file_text' in block.input:
-                                logger.info(f"Generated Python Code:")
-                                logger.info(block.input['file_text'])
-                            elif 'command' in block.input:
-                                logger.info(f"Bash Command: {block.input['command']}")
-                    # Log full content for code generation verification
-                    logger.info("Full server tool content:")
-                    for attr in ['input', 'name', 'id', 'type']:
-                        if hasattr(block, attr):
-                            value = getattr(block, attr)
-                            logger.info(f"  {attr}: {value}")
-                elif hasattr(block, 'type') and 'tool_result' in block.type:
-                    logger.info(f"Tool Result Type: {block.type}")
-                    if hasattr(block, 'tool_use_id'):
-                        logger.info(f"Tool Use ID: {block.tool_use_id}")
-                    if hasattr(block, 'content'):
-                        content = str(block.content)[:500]  # 増やして詳細表示
-                        logger.info(f"Content: {content}{'...' if len(str(block.content)) > 500 else ''}")
-                        # Log stdout if available (for bash execution results)
-                        if hasattr(block, 'content') and hasattr(block.content, 'stdout'):
-                            logger.info(f"Stdout: {block.content.stdout}")
-                else:
-                    logger.info(f"Unknown block type: {block.type}")
-                    # Log all available attributes for unknown types
-                    logger.info("All attributes:")
-                    for attr in dir(block):
-                        if not attr.startswith('_'):
-                            try:
-                                value = getattr(block, attr)
-                                if not callable(value):
-                                    logger.info(f"  {attr}: {value}")
-                            except:
-                                pass
-                logger.info("---")
-            logger.info(f"==========================================")
+            # ブロック単位の詳細ログはDEBUG時のみ組み立てる
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("=== CLAUDE RESPONSE (Turn %d) ===", turn_count)
+                for i, block in enumerate(response.content):
+                    _log_block(i, block)
+                logger.debug("==========================================")
+
+            # Collect only the final markdown result with ASCII bar chart
+            for block in response.content:
+                if block.type == "text" and _is_final_report(block.text):
+                    markdown_result = block.text  # Only keep the final result
 
             if response.stop_reason == "end_turn":
                 logger.info("Conversation completed")
@@ -334,7 +628,7 @@ def run_analysis() -> str:
                 tool_results = []
 
                 for i, block in enumerate(response.content):
-                    logger.debug(f"Processing content block {i}: type={block.type}")
+                    logger.debug("Processing content block %d: type=%s", i, block.type)
 
                     if block.type == "tool_use":
                         logger.info(f"Executing tool: {block.name}")
@@ -350,10 +644,23 @@ def run_analysis() -> str:
                         logger.info(f"Server tool executed: {block.name}")
                         # Server tool results are handled automatically, don't add to tool_results
 
-                messages.append({"role": "assistant", "content": response.content})
+                # 前のターンのツール結果はモデルが既に読んだので、以降の履歴では縮める
+                for previous_result in previous_tool_results:
+                    trimmed = _trim_tool_result(previous_result["content"])
+                    if log_input_size:
+                        conversation_chars -= len(previous_result["content"]) - len(trimmed)
+                    previous_result["content"] = trimmed
+                previous_tool_results = tool_results
+
+                assistant_content = _minimize_blocks(response.content)
+                messages.append({"role": "assistant", "content": assistant_content})
                 if tool_results:  # Only add if there are actual tool results
                     messages.append({"role": "user", "content": tool_results})
 
+                if log_input_size:
+                    conversation_chars += sum(len(str(block)) for block in assistant_content)
+                    conversation_chars += sum(len(r["content"]) for r in tool_results)
+
                 logger.info(f"Added {len(tool_results)} tool results to conversation")
                 logger.info(f"Total conversation length: {len(messages)} messages")
 
@@ -377,8 +684,10 @@ def main():
 
         # Save markdown result to output.md
         output_path = "output.md"
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(markdown_result)
+        # 一時ファイルへバイト列で書き込んでから置き換え、途中までの出力を残さない
+        tmp_path = Path(f"{output_path}.tmp")
+        tmp_path.write_bytes(markdown_result.encode("utf-8"))
+        os.replace(tmp_path, output_path)
 
         logger.info(f"Analysis completed and saved to {output_path}")
         logger.info(f"Saved {len(markdown_result)} characters")